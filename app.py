@@ -1,13 +1,26 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, StreamingResponse
 import datetime
+import json
+import queue
+import threading
+import time
+import uuid
 import main
+import google_client
+import gmail_watch
 import uvicorn
 import os
 
 app = FastAPI()
 templates = Jinja2Templates(directory="templates")
+push_coalescer = gmail_watch.PushCoalescer()
+# Streamed runs waiting for (or being read by) their event stream subscriber, by run id
+stream_runs = {}
+# Finished runs nobody subscribed to are dropped after this long
+UNCLAIMED_RUN_SECONDS = 300
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
@@ -19,6 +32,87 @@ async def run_agent(request: Request):
     logs = main.run_agent()
     return templates.TemplateResponse("index.html", {"request": request, "logs": logs, "year": datetime.datetime.now().year})
 
+@app.post("/run/stream")
+def start_agent_stream():
+    # Starts a streamed run; its events are read from GET /run/stream/<run_id>
+    now = time.time()
+    for run_id, run in list(stream_runs.items()):
+        if run["finished"] and now - run["finished"] > UNCLAIMED_RUN_SECONDS:
+            stream_runs.pop(run_id, None)
+
+    run_id = uuid.uuid4().hex
+    run = {"events": queue.Queue(), "finished": None}
+    stream_runs[run_id] = run
+
+    def worker():
+        try:
+            main.run_agent(on_event=lambda kind, data: run["events"].put((kind, data)))
+        except Exception as e:
+            run["events"].put(("log", f"Agent run failed: {e}"))
+        run["events"].put(None)
+        run["finished"] = time.time()
+
+    threading.Thread(target=worker, daemon=True).start()
+    return {"run_id": run_id}
+
+@app.get("/run/stream/{run_id}")
+def run_agent_stream(run_id: str):
+    # Server-sent events: log lines, draft tokens and time-to-first-token as they happen
+    run = stream_runs.pop(run_id, None)
+    if run is None:
+        return Response(status_code=404)
+    events = run["events"]
+
+    def event_stream():
+        while True:
+            item = events.get()
+            if item is None:
+                yield "event: done\ndata: {}\n\n"
+                break
+            kind, data = item
+            yield f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/gmail/watch")
+async def gmail_watch_register():
+    # Registers users.watch on the Pub/Sub topic and records the starting history id
+    topic_name = os.environ.get("GMAIL_PUBSUB_TOPIC")
+    if not topic_name:
+        return {"error": "GMAIL_PUBSUB_TOPIC environment variable is not set."}
+    service = google_client.get_service("gmail", "v1")
+    if not service:
+        return {"error": "Could not connect to Gmail service."}
+    watch = google_client.watch_mailbox(service, topic_name)
+    if not watch:
+        return {"error": "Gmail watch request failed."}
+    push_coalescer.set_baseline(watch["historyId"])
+    return watch
+
+@app.get("/gmail/watch")
+async def gmail_watch_status():
+    # The history id push processing resumes from and the logs of the last push run
+    return {"historyId": push_coalescer.last_history_id, "logs": push_coalescer.last_logs}
+
+@app.post("/gmail/push")
+async def gmail_push(request: Request):
+    # Pub/Sub push endpoint; the mail is processed before acking, so a failure is redelivered
+    authorized = await run_in_threadpool(gmail_watch.verify_push_request, request.headers.get("authorization"), request.query_params.get("token"))
+    if not authorized:
+        return Response(status_code=403)
+    try:
+        envelope = await request.json()
+    except ValueError:
+        envelope = None
+    notification = gmail_watch.decode_push_envelope(envelope)
+    if notification:
+        try:
+            await run_in_threadpool(push_coalescer.handle, notification["historyId"])
+        except Exception as e:
+            print(f"Error processing push notification: {e}")
+            return Response(status_code=500)
+    return Response(status_code=204)
+
 if __name__ == '__main__':
     port = int(os.getenv("PORT", 5000))
     uvicorn.run(app, host='0.0.0.0', port=port)
@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+INDEX_DIR = os.environ.get("CORRESPONDENCE_INDEX_DIR", "correspondence_index")
+# Approximate prompt tokens that retrieved past exchanges may use in a draft prompt
+RELATED_TOKEN_BUDGET = int(os.environ.get("RELATED_TOKEN_BUDGET", "800"))
+# Cosine similarity below which a past exchange is not considered relevant
+RELATED_MIN_SCORE = float(os.environ.get("RELATED_MIN_SCORE", "0.55"))
+MAX_RECORD_CHARS = 2000
+INITIAL_CAPACITY = 1024
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) used for prompt budgeting."""
+    return len(text) // 4 + 1
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+class CorrespondenceIndex:
+    """
+    Append-only on-disk vector index of past correspondence.
+    Unit-normalised float32 vectors live in a memory-mapped matrix (vectors.f32) that grows by
+    doubling; records.jsonl is the id map. A line with a new id takes the next row, and a line
+    repeating an id replaces that row's record (its vector is overwritten in place). Vectors are
+    flushed before their records are appended, so the unique id count is always the valid row count.
+    """
+
+    def __init__(self, directory=INDEX_DIR, dim=768):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.records_path = os.path.join(directory, "records.jsonl")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r") as f:
+                meta = json.load(f)
+            self.dim, self.capacity = meta["dim"], meta["capacity"]
+        else:
+            self.dim, self.capacity = dim, INITIAL_CAPACITY
+
+        self.records = []
+        self.row_by_id = {}
+        lines = 0
+        if os.path.exists(self.records_path):
+            with open(self.records_path, "r") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    lines += 1
+                    record = json.loads(line)
+                    row = self.row_by_id.get(record["id"])
+                    if row is None:
+                        self.row_by_id[record["id"]] = len(self.records)
+                        self.records.append(record)
+                    else:
+                        self.records[row] = record
+        # Replaced records (e.g. re-drafted threads) leave superseded lines behind; drop them
+        # once they outnumber the live ones
+        if lines - len(self.records) > len(self.records):
+            self._compact()
+
+        mode = "r+" if os.path.exists(self.vectors_path) else "w+"
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode=mode, shape=(self.capacity, self.dim))
+        self._write_meta()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, record_id):
+        return record_id in self.row_by_id
+
+    def get(self, record_id):
+        row = self.row_by_id.get(record_id)
+        return None if row is None else self.records[row]
+
+    def _compact(self):
+        """Rewrites records.jsonl with one line per row, in row order."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".jsonl")
+        with os.fdopen(fd, "w") as f:
+            for record in self.records:
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp_path, self.records_path)
+
+    def _write_meta(self):
+        with open(self.meta_path, "w") as f:
+            json.dump({"dim": self.dim, "capacity": self.capacity}, f)
+
+    def _grow(self, needed):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        self.vectors.flush()
+        del self.vectors
+        with open(self.vectors_path, "r+b") as f:
+            f.truncate(capacity * self.dim * 4)
+        self.capacity = capacity
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+        self._write_meta()
+
+    def add(self, records, vectors, replace=False):
+        """
+        Adds records ({"id", "text", ...}) with their embedding vectors. Records whose id is
+        already indexed are skipped, or replace the existing row when replace=True. Within one
+        call, a repeated id keeps its last record. Returns the number added or replaced.
+        """
+        with self._lock:
+            batch = {}
+            for record, vector in zip(records, vectors):
+                batch[record["id"]] = (record, vector)
+            new_rows = []
+            replaced = []
+            for record, vector in batch.values():
+                row = self.row_by_id.get(record["id"])
+                if row is None:
+                    new_rows.append((record, vector))
+                elif replace:
+                    replaced.append((row, record, vector))
+            if not new_rows and not replaced:
+                return 0
+
+            start = len(self.records)
+            end = start + len(new_rows)
+            if end > self.capacity:
+                self._grow(end)
+            if new_rows:
+                self.vectors[start:end] = normalize([vector for _, vector in new_rows])
+            for row, _, vector in replaced:
+                self.vectors[row] = normalize(vector)
+            self.vectors.flush()
+
+            with open(self.records_path, "a") as f:
+                for row, (record, _) in enumerate(new_rows, start):
+                    record = dict(record, text=record["text"][:MAX_RECORD_CHARS])
+                    f.write(json.dumps(record) + "\n")
+                    self.records.append(record)
+                    self.row_by_id[record["id"]] = row
+                for row, record, _ in replaced:
+                    record = dict(record, text=record["text"][:MAX_RECORD_CHARS])
+                    f.write(json.dumps(record) + "\n")
+                    self.records[row] = record
+            return len(new_rows) + len(replaced)
+
+    def search(self, query_vector, k=5, exclude_thread_id=None):
+        """
+        Returns the top-k (score, record) pairs by cosine similarity, best first,
+        keeping only the best match per thread so one conversation cannot fill the results.
+        """
+        count = len(self.records)
+        if not count:
+            return []
+        scores = self.vectors[:count] @ normalize(query_vector)
+        # Over-fetch so excluded and same-thread rows do not shrink the result set
+        k_fetch = min(count, k * 4)
+        top = np.argpartition(-scores, k_fetch - 1)[:k_fetch]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        seen_threads = set()
+        for row in top:
+            record = self.records[row]
+            thread_id = record.get("threadId")
+            if exclude_thread_id and thread_id == exclude_thread_id:
+                continue
+            if thread_id:
+                if thread_id in seen_threads:
+                    continue
+                seen_threads.add(thread_id)
+            results.append((float(scores[row]), record))
+            if len(results) == k:
+                break
+        return results
+
+def select_within_budget(results, token_budget=RELATED_TOKEN_BUDGET, min_score=RELATED_MIN_SCORE):
+    """Keeps the best-scoring relevant results whose combined text fits within token_budget."""
+    selected = []
+    used = 0
+    for score, record in results:
+        if score < min_score:
+            break
+        cost = estimate_tokens(record["text"])
+        if used + cost > token_budget:
+            continue
+        selected.append(record)
+        used += cost
+    return selected
+
+def benchmark(size, dim, queries, k):
+    """Builds a random index of the given size in a temp dir and reports add and query latency."""
+    rng = np.random.default_rng(0)
+    batch = 10000
+    with tempfile.TemporaryDirectory() as directory:
+        index = CorrespondenceIndex(directory, dim)
+        start = time.perf_counter()
+        for offset in range(0, size, batch):
+            n = min(batch, size - offset)
+            records = [{"id": f"msg-{offset + i}", "text": f"Sample message {offset + i}"} for i in range(n)]
+            index.add(records, rng.standard_normal((n, dim), dtype=np.float32))
+        build_s = time.perf_counter() - start
+        print(f"Built index of {len(index)} x {dim} in {build_s:.1f} s")
+
+        start = time.perf_counter()
+        index.add([{"id": "incremental", "text": "One new sent message"}], rng.standard_normal((1, dim), dtype=np.float32))
+        print(f"Incremental add of 1 record: {(time.perf_counter() - start) * 1000:.2f} ms")
+
+        start = time.perf_counter()
+        reopened = CorrespondenceIndex(directory)
+        print(f"Reopened index in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        latencies = []
+        for query in rng.standard_normal((queries, dim), dtype=np.float32):
+            start = time.perf_counter()
+            reopened.search(query, k)
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        print(f"Top-{k} query latency over {queries} queries: p50 {p50:.2f} ms, p95 {p95:.2f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the correspondence vector index.")
+    parser.add_argument("--size", type=int, default=100000, help="Number of indexed messages.")
+    parser.add_argument("--dim", type=int, default=768, help="Embedding dimension.")
+    parser.add_argument("--queries", type=int, default=200, help="Number of timed queries.")
+    parser.add_argument("-k", type=int, default=5, help="Results per query.")
+    args = parser.parse_args()
+    benchmark(args.size, args.dim, args.queries, args.k)
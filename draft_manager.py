@@ -0,0 +1,226 @@
+import argparse
+import base64
+import html
+import re
+import time
+from email.message import EmailMessage
+from bs4 import BeautifulSoup
+from googleapiclient.errors import HttpError
+
+# Header marking drafts written by the agent, so they can be replaced on later runs
+AGENT_DRAFT_HEADER = "X-Agent-Mailman"
+# Only ask Gmail for the fields we use, keeping list/create/update responses small
+DRAFT_FIELDS = "id,message(id,threadId)"
+HTML_TAG_RE = re.compile(r"<[a-zA-Z][^>]*>")
+
+def html_to_text(body):
+    """Plain-text rendering of an HTML draft body (<br> and block tags become line breaks)."""
+    soup = BeautifulSoup(body, "html.parser")
+    for br in soup.find_all("br"):
+        br.replace_with("\n")
+    for block in soup.find_all(["p", "div", "li"]):
+        block.append("\n")
+    return re.sub(r"\n{3,}", "\n\n", soup.get_text()).strip()
+
+def build_raw_message(message_body):
+    """
+    Builds the base64url-encoded RFC 822 message for a draft. The body is sent as
+    multipart/alternative with text/plain and text/html parts, since the model writes HTML.
+    """
+    body = message_body["body"]
+    if HTML_TAG_RE.search(body):
+        html_body = body
+        text_body = html_to_text(body)
+    else:
+        html_body = html.escape(body).replace("\n", "<br>\n")
+        text_body = body
+
+    message = EmailMessage()
+    message["To"] = message_body["to"]
+    message["Subject"] = message_body["subject"]
+    message[AGENT_DRAFT_HEADER] = "draft"
+    message.set_content(text_body)
+    message.add_alternative(html_body, subtype="html")
+    return base64.urlsafe_b64encode(message.as_bytes()).decode()
+
+class DraftManager:
+    """
+    Per-run view of the mailbox's drafts. Existing drafts are listed once (on first use) into
+    an in-memory index keyed by thread; agent drafts are then updated in place with
+    drafts.update instead of a new draft being created next to them.
+    """
+
+    def __init__(self, service, user_id="me"):
+        self.service = service
+        self.user_id = user_id
+        self.drafts_by_thread = None
+
+    def load(self):
+        """Lists all drafts once into {thread_id: [{"id", "messageId"}, ...]}."""
+        self.drafts_by_thread = {}
+        params = {"userId": self.user_id, "fields": f"drafts({DRAFT_FIELDS}),nextPageToken"}
+        try:
+            while True:
+                results = self.service.users().drafts().list(**params).execute()
+                for draft in results.get("drafts", []):
+                    self.remember(draft)
+                page_token = results.get("nextPageToken")
+                if not page_token:
+                    break
+                params["pageToken"] = page_token
+        except HttpError as error:
+            print(f"Gmail error: {error}")
+
+    def remember(self, draft):
+        message = draft.get("message", {})
+        entries = self.drafts_by_thread.setdefault(message.get("threadId"), [])
+        entries.append({"id": draft["id"], "messageId": message.get("id")})
+
+    def forget(self, thread_id, draft_id):
+        entries = self.drafts_by_thread.get(thread_id, [])
+        self.drafts_by_thread[thread_id] = [e for e in entries if e["id"] != draft_id]
+
+    def save(self, message_body, thread_id, agent_message_ids=()):
+        """
+        Writes the agent's draft for a thread. If the thread already has an agent draft
+        (identified by its message ids from threads.get), the first one is updated in place
+        and any extra stacked ones are deleted. Returns (draft, "created" | "updated") or (None, None).
+        """
+        existing = []
+        if agent_message_ids:
+            if self.drafts_by_thread is None:
+                self.load()
+            existing = [e for e in self.drafts_by_thread.get(thread_id, []) if e["messageId"] in agent_message_ids]
+
+        message = {"threadId": thread_id, "raw": build_raw_message(message_body)}
+        drafts = self.service.users().drafts()
+        draft = None
+        action = None
+        try:
+            if existing:
+                target = existing.pop(0)
+                try:
+                    draft = drafts.update(userId=self.user_id, id=target["id"], fields=DRAFT_FIELDS,
+                                          body={"id": target["id"], "message": message}).execute()
+                    action = "updated"
+                except HttpError as error:
+                    # The draft was sent or deleted since load(); create a fresh one instead
+                    if error.resp.status != 404:
+                        raise
+                    print(f"Draft {target['id']} no longer exists, creating a new one.")
+                self.forget(thread_id, target["id"])
+            if draft is None:
+                draft = drafts.create(userId=self.user_id, fields=DRAFT_FIELDS,
+                                      body={"message": message}).execute()
+                action = "created"
+        except HttpError as error:
+            print(f"Gmail error: {error}")
+            return None, None
+
+        if self.drafts_by_thread is not None:
+            self.remember(draft)
+
+        # Clean up extra stacked agent drafts; a failure here does not undo the saved draft
+        for extra in existing:
+            try:
+                drafts.delete(userId=self.user_id, id=extra["id"]).execute()
+                self.forget(thread_id, extra["id"])
+            except HttpError as error:
+                print(f"Could not delete stacked draft {extra['id']}: {error}")
+        return draft, action
+
+def benchmark(existing_drafts, threads, latency_ms):
+    """
+    Simulates a run against a mailbox with many pre-existing drafts, comparing the previous
+    per-thread delete + create approach with in-place updates through DraftManager.
+    """
+    class FakeRequest:
+        def __init__(self, result):
+            self.result = result
+
+        def execute(self):
+            time.sleep(latency_ms / 1000)
+            return self.result
+
+    class FakeDrafts:
+        def __init__(self, mailbox):
+            self.mailbox = mailbox
+            self.calls = 0
+            self.next_id = len(mailbox)
+
+        def new_draft(self, body):
+            self.next_id += 1
+            message = body["message"]
+            return {"id": body.get("id", f"d{self.next_id}"), "message": {"id": f"m{self.next_id}", "threadId": message["threadId"]}}
+
+        def list(self, userId, fields=None, pageToken=None):
+            self.calls += 1
+            start = int(pageToken or 0)
+            page = {"drafts": self.mailbox[start:start + 100]}
+            if start + 100 < len(self.mailbox):
+                page["nextPageToken"] = str(start + 100)
+            return FakeRequest(page)
+
+        def create(self, userId, body, fields=None):
+            self.calls += 1
+            return FakeRequest(self.new_draft(body))
+
+        def update(self, userId, id, body, fields=None):
+            self.calls += 1
+            return FakeRequest(self.new_draft(body))
+
+        def delete(self, userId, id):
+            self.calls += 1
+            return FakeRequest({})
+
+    class FakeService:
+        def __init__(self, mailbox):
+            self.fake_drafts = FakeDrafts(mailbox)
+
+        def users(self):
+            return self
+
+        def drafts(self):
+            return self.fake_drafts
+
+    # Every processed thread already has one agent draft; the rest of the mailbox is unrelated drafts
+    mailbox = [{"id": f"d{i}", "message": {"id": f"m{i}", "threadId": f"t{i}"}} for i in range(existing_drafts)]
+    message_body = {"to": "someone@example.com", "subject": "Re: Hello", "body": "Thanks!<br>Talk soon."}
+
+    # Previous approach: list drafts once, then delete + create per thread
+    service = FakeService(mailbox)
+    start = time.perf_counter()
+    draft_ids = {}
+    request = {"userId": "me"}
+    while True:
+        results = service.drafts().list(**request).execute()
+        draft_ids.update({d["message"]["id"]: d["id"] for d in results["drafts"]})
+        if "nextPageToken" not in results:
+            break
+        request["pageToken"] = results["nextPageToken"]
+    for i in range(threads):
+        service.drafts().delete(userId="me", id=draft_ids[f"m{i}"]).execute()
+        service.drafts().create(userId="me", body={"message": {"threadId": f"t{i}", "raw": build_raw_message(message_body)}}).execute()
+    baseline_s = time.perf_counter() - start
+    print(f"delete + create: {service.fake_drafts.calls} API calls, {baseline_s:.2f} s")
+
+    service = FakeService(mailbox)
+    manager = DraftManager(service)
+    start = time.perf_counter()
+    for i in range(threads):
+        manager.save(message_body, f"t{i}", {f"m{i}"})
+    managed_s = time.perf_counter() - start
+    print(f"DraftManager update: {service.fake_drafts.calls} API calls, {managed_s:.2f} s")
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        build_raw_message(message_body)
+    print(f"Encoding: {(time.perf_counter() - start):.3f} ms per draft, {len(build_raw_message(message_body))} bytes raw")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark draft dedup against a simulated mailbox.")
+    parser.add_argument("--existing-drafts", type=int, default=5000, help="Drafts already in the mailbox.")
+    parser.add_argument("--threads", type=int, default=50, help="Threads drafted in the run.")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Simulated latency per API call.")
+    args = parser.parse_args()
+    benchmark(args.existing_drafts, args.threads, args.latency_ms)
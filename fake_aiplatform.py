@@ -0,0 +1,111 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import types
+
+# Simulated per-call latency, so the concurrent scan and delete paths are exercised
+LATENCY_SECONDS = 0.05
+REGIONS = ["asia-east1", "bad-region", "europe-west4", "us-central1"]
+
+class FakeResource:
+    """Stands in for aiplatform.Model / aiplatform.Endpoint instances."""
+
+    def __init__(self, kind, region, index):
+        self.display_name = f"{kind}-{region}-{index}"
+        self.resource_name = f"projects/fake-project/locations/{region}/{kind}s/{index}"
+        self.deleted = False
+
+    def delete(self, force=False):
+        time.sleep(LATENCY_SECONDS)
+        # Model 1 in every region is still deployed somewhere, so its delete fails
+        if self.display_name.startswith("model-") and self.display_name.endswith("-1"):
+            raise RuntimeError("400 Model is deployed to an endpoint")
+        self.deleted = True
+
+def make_resource_class(kind):
+    class FakeResourceClass:
+        @staticmethod
+        def list(project, location):
+            time.sleep(LATENCY_SECONDS)
+            if location == "bad-region":
+                raise RuntimeError("503 The service is currently unavailable.")
+            return [FakeResource(kind, location, i) for i in range(2)]
+    return FakeResourceClass
+
+class FakeEndpointServiceClient:
+    def list_locations(self, request):
+        return types.SimpleNamespace(locations=[types.SimpleNamespace(location_id=r) for r in REGIONS])
+
+def install():
+    """Puts fake google.cloud.aiplatform modules in sys.modules, so no credentials or API calls are needed."""
+    try:
+        import google.cloud as cloud
+    except ImportError:
+        google = sys.modules.setdefault("google", types.ModuleType("google"))
+        cloud = types.ModuleType("google.cloud")
+        google.cloud = cloud
+        sys.modules["google.cloud"] = cloud
+
+    aiplatform = types.ModuleType("google.cloud.aiplatform")
+    aiplatform.Model = make_resource_class("model")
+    aiplatform.Endpoint = make_resource_class("endpoint")
+    aiplatform.gapic = types.SimpleNamespace(EndpointServiceClient=FakeEndpointServiceClient)
+    aiplatform_v1 = types.ModuleType("google.cloud.aiplatform_v1")
+    cloud.aiplatform = aiplatform
+    cloud.aiplatform_v1 = aiplatform_v1
+    sys.modules["google.cloud.aiplatform"] = aiplatform
+    sys.modules["google.cloud.aiplatform_v1"] = aiplatform_v1
+
+def run_main(*args):
+    """Runs list_vertex_resources.main() with the given arguments and returns its stdout."""
+    import list_vertex_resources
+    stdout = io.StringIO()
+    old_argv = sys.argv
+    sys.argv = ["list_vertex_resources.py", *args]
+    try:
+        with contextlib.redirect_stdout(stdout):
+            list_vertex_resources.main()
+    finally:
+        sys.argv = old_argv
+    return stdout.getvalue()
+
+def check():
+    """Exercises list_vertex_resources against the fake API and asserts on the results."""
+    install()
+    os.environ["GOOGLE_CLOUD_PROJECT"] = "fake-project"
+    import list_vertex_resources
+
+    start = time.perf_counter()
+    results = list_vertex_resources.scan_regions("fake-project", REGIONS)
+    elapsed = time.perf_counter() - start
+    assert len(results["bad-region"]["errors"]) == 2, results["bad-region"]
+    assert all("Service unavailable" in e for e in results["bad-region"]["errors"])
+    assert all(len(results[r]["models"]) == 2 and len(results[r]["endpoints"]) == 2 for r in REGIONS if r != "bad-region")
+    print(f"scan_regions: {len(REGIONS)} regions, bad-region errors reported, {elapsed:.2f} s")
+
+    models = [m for found in results.values() for m in found["models"]]
+    outcomes = list_vertex_resources.delete_resources(models, "models", quiet=True)
+    failed = [o for o in outcomes if not o["deleted"]]
+    assert len(outcomes) == len(models) == 6
+    assert len(failed) == 3 and all("deployed" in o["error"] for o in failed)
+    assert sum(1 for m in models if m.deleted) == 3
+    print(f"delete_resources: {len(outcomes) - len(failed)} deleted, {len(failed)} failed deletes reported")
+
+    output = json.loads(run_main("--json"))
+    assert output["project"] == "fake-project"
+    assert sorted(output["regions"]) == REGIONS
+    assert output["regions"]["us-central1"]["models"][0]["id"].startswith("projects/fake-project/locations/us-central1/")
+    print("main --json: stdout is valid JSON")
+
+    output = json.loads(run_main("--json", "--delete"))
+    assert output["deleted"]["endpoints"]["deleted"] == 6
+    assert output["deleted"]["models"]["deleted"] == 3 and len(output["deleted"]["models"]["failed"]) == 3
+    print("main --json --delete: per-kind delete summary reported")
+
+if __name__ == "__main__":
+    # Offline check of list_vertex_resources: python fake_aiplatform.py
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    check()
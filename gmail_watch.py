@@ -0,0 +1,133 @@
+import base64
+import hmac
+import json
+import os
+import threading
+import time
+import cachecontrol
+import requests
+from google.auth.transport import requests as google_requests
+from google.oauth2 import id_token
+import correspondence_index
+import main
+import secret_manager_utils
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Bursts of push notifications arriving within this window are handled as one run.
+DEBOUNCE_SECONDS = float(os.environ.get("PUSH_DEBOUNCE_SECONDS", "2.0"))
+# Last processed history id, kept next to the correspondence index so restarts resume from it
+PUSH_STATE_PATH = os.environ.get("PUSH_STATE_PATH", os.path.join(correspondence_index.INDEX_DIR, "push_state.json"))
+
+# Push authentication: an OIDC token from the Pub/Sub subscription (PUSH_AUDIENCE, optionally
+# pinned to PUSH_SERVICE_ACCOUNT) and/or a shared ?token= query parameter held in Secret Manager.
+PUSH_AUDIENCE = os.environ.get("PUSH_AUDIENCE")
+PUSH_SERVICE_ACCOUNT = os.environ.get("PUSH_SERVICE_ACCOUNT")
+push_token_id = os.environ.get("SECRET_PUSH_TOKEN")
+PUSH_TOKEN = secret_manager_utils.get_secret(push_token_id) if push_token_id else None
+# Google's signing certs are fetched per verification; the cached session honours their Cache-Control
+certs_request = google_requests.Request(session=cachecontrol.CacheControl(requests.session()))
+
+def verify_push_request(authorization, token):
+    """
+    Checks that a push request really comes from our Pub/Sub subscription.
+    Rejects everything when no verification method is configured. Blocking (may fetch certs).
+    """
+    if not PUSH_AUDIENCE and not PUSH_TOKEN:
+        print("Rejecting push: configure PUSH_AUDIENCE or SECRET_PUSH_TOKEN to accept notifications.")
+        return False
+
+    if PUSH_TOKEN and not hmac.compare_digest((token or "").encode(), PUSH_TOKEN.encode()):
+        print("Rejecting push: invalid verification token.")
+        return False
+
+    if PUSH_AUDIENCE:
+        if not authorization or not authorization.startswith("Bearer "):
+            print("Rejecting push: missing bearer token.")
+            return False
+        try:
+            claims = id_token.verify_oauth2_token(authorization[len("Bearer "):], certs_request, audience=PUSH_AUDIENCE)
+        except ValueError as e:
+            print(f"Rejecting push: invalid OIDC token: {e}")
+            return False
+        if PUSH_SERVICE_ACCOUNT and (claims.get("email") != PUSH_SERVICE_ACCOUNT or not claims.get("email_verified")):
+            print(f"Rejecting push: unexpected caller {claims.get('email')}.")
+            return False
+
+    return True
+
+def decode_push_envelope(envelope):
+    """
+    Extracts the Gmail notification from a Pub/Sub push envelope.
+    Returns {"emailAddress": ..., "historyId": int} or None if the envelope is malformed.
+    """
+    try:
+        data = envelope["message"]["data"]
+        notification = json.loads(base64.b64decode(data).decode("utf-8"))
+        return {
+            "emailAddress": notification.get("emailAddress"),
+            "historyId": int(notification["historyId"]),
+        }
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"Ignoring malformed push envelope: {e}")
+        return None
+
+class PushCoalescer:
+    """
+    Debounces Gmail push notifications and coalesces their history ids.
+    Notifications are processed inside their push request (Cloud Run throttles CPU outside
+    requests), one run at a time: requests that arrive during the debounce window or while a
+    run is in progress wait for it, and return without another run if it already covered
+    their history id. The last processed history id is kept on disk across restarts.
+    """
+
+    def __init__(self, process=main.run_agent_for_history, debounce_seconds=DEBOUNCE_SECONDS, state_path=PUSH_STATE_PATH):
+        # process(start_history_id) -> (logs, latest_history_id)
+        self.process = process
+        self.debounce_seconds = debounce_seconds
+        self.state_path = state_path
+        self.last_history_id = self.load_state()
+        self.last_logs = []
+        self._lock = threading.Lock()
+
+    def load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return None
+        try:
+            with open(self.state_path, "r") as f:
+                return int(json.load(f)["historyId"])
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Ignoring unreadable push state {self.state_path}: {e}")
+            return None
+
+    def set_baseline(self, history_id):
+        """Sets the history id to start from, e.g. from a users.watch response."""
+        self.last_history_id = int(history_id)
+        if self.state_path:
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            with open(self.state_path, "w") as f:
+                json.dump({"historyId": self.last_history_id}, f)
+
+    def covers(self, history_id):
+        return self.last_history_id is not None and history_id <= self.last_history_id
+
+    def handle(self, history_id):
+        """
+        Processes the mail behind one notification; blocks until done. Exceptions propagate
+        so the push is not acknowledged and Pub/Sub redelivers it with backoff.
+        """
+        history_id = int(history_id)
+        if self.covers(history_id):
+            return
+        # Let the rest of a burst arrive; its requests queue on the lock behind this one
+        time.sleep(self.debounce_seconds)
+        with self._lock:
+            if self.covers(history_id):
+                return
+            logs, latest_history_id = self.process(self.last_history_id)
+            self.last_logs = logs
+            # Only trust the history id Gmail returned, never the one in the notification payload
+            if latest_history_id is not None:
+                self.set_baseline(latest_history_id)
@@ -1,13 +1,14 @@
 import os.path
 import base64
 import json
-from email.message import EmailMessage
+import re
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 import secret_manager_utils
+import draft_manager
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -23,6 +24,8 @@ SCOPES = [
     "https://www.googleapis.com/auth/tasks"
 ]
 
+QUOTE_HEADER_RE = re.compile(r"^On .+ wrote:$")
+
 def get_credentials():
     """Retrieves or refreshes Google OAuth2 credentials."""
     creds = None
@@ -84,48 +87,155 @@ def get_unread_messages(service):
         print(f"Gmail error: {error}")
         return []
 
+def list_messages(service, query, page_token=None):
+    """Lists one page of messages matching a Gmail search query. Returns (messages, next_page_token)."""
+    params = {"userId": "me", "q": query}
+    if page_token:
+        params["pageToken"] = page_token
+    try:
+        results = service.users().messages().list(**params).execute()
+        return results.get("messages", []), results.get("nextPageToken")
+    except HttpError as error:
+        print(f"Gmail error: {error}")
+        return [], None
+
+def get_history_messages(service, start_history_id):
+    """
+    Lists unread inbox messages added since start_history_id.
+    Returns (messages, latest_history_id) where messages are {"id", "threadId"} stubs,
+    or (None, start_history_id) if the history id has expired (404) and a full sync is required.
+    Other errors (e.g. 429 or 5xx) are re-raised so the caller can retry from the same history id.
+    """
+    messages = []
+    seen = set()
+    latest_history_id = start_history_id
+    params = {
+        "userId": "me",
+        "startHistoryId": str(start_history_id),
+        "historyTypes": ["messageAdded"],
+        "labelId": "INBOX",
+    }
+    try:
+        while True:
+            results = service.users().history().list(**params).execute()
+            for record in results.get("history", []):
+                for added in record.get("messagesAdded", []):
+                    message = added.get("message", {})
+                    msg_id = message.get("id")
+                    if msg_id and msg_id not in seen and "UNREAD" in message.get("labelIds", []):
+                        seen.add(msg_id)
+                        messages.append({"id": msg_id, "threadId": message.get("threadId")})
+            latest_history_id = results.get("historyId", latest_history_id)
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                break
+            params["pageToken"] = page_token
+        return messages, latest_history_id
+    except HttpError as error:
+        print(f"Gmail history error: {error}")
+        if error.resp.status == 404:
+            return None, start_history_id
+        raise
+
+def get_history_id(service):
+    """Returns the mailbox's current history id from users.getProfile, or None on error."""
+    try:
+        return service.users().getProfile(userId="me").execute().get("historyId")
+    except HttpError as error:
+        print(f"Gmail error: {error}")
+        return None
+
+def watch_mailbox(service, topic_name):
+    """Registers a Gmail push watch on the inbox. Returns the watch response (historyId, expiration)."""
+    request = {"topicName": topic_name, "labelIds": ["INBOX"], "labelFilterBehavior": "INCLUDE"}
+    try:
+        return service.users().watch(userId="me", body=request).execute()
+    except HttpError as error:
+        print(f"Gmail watch error: {error}")
+        return None
+
+def parse_message(message):
+    """Extracts subject, sender, plain-text body and labels from a Gmail message resource."""
+    payload = message.get("payload", {})
+    headers = payload.get("headers", [])
+    
+    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), "No Subject")
+    sender = next((h['value'] for h in headers if h['name'] == 'From'), "Unknown Sender")
+    
+    body = ""
+    if "parts" in payload:
+        for part in payload["parts"]:
+            if part["mimeType"] == "text/plain":
+                data = part["body"].get("data")
+                if data:
+                    body = base64.urlsafe_b64decode(data).decode()
+                    break
+    else:
+        data = payload["body"].get("data")
+        if data:
+            body = base64.urlsafe_b64decode(data).decode()
+
+    return {
+        "id": message.get("id"),
+        "subject": subject,
+        "sender": sender,
+        "body": body,
+        "threadId": message.get("threadId"),
+        "labelIds": message.get("labelIds", []),
+        "isAgentDraft": any(h['name'] == draft_manager.AGENT_DRAFT_HEADER for h in headers)
+    }
+
 def get_message_content(service, msg_id):
     try:
         message = service.users().messages().get(userId="me", id=msg_id).execute()
-        payload = message.get("payload", {})
-        headers = payload.get("headers", [])
-        
-        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), "No Subject")
-        sender = next((h['value'] for h in headers if h['name'] == 'From'), "Unknown Sender")
-        
-        body = ""
-        if "parts" in payload:
-            for part in payload["parts"]:
-                if part["mimeType"] == "text/plain":
-                    data = part["body"].get("data")
-                    if data:
-                        body = base64.urlsafe_b64decode(data).decode()
-                        break
-        else:
-            data = payload["body"].get("data")
-            if data:
-                body = base64.urlsafe_b64decode(data).decode()
-
-        return {
-            "id": msg_id,
-            "subject": subject,
-            "sender": sender,
-            "body": body,
-            "threadId": message.get("threadId")
-        }
+        content = parse_message(message)
+        return {key: content[key] for key in ("id", "subject", "sender", "body", "threadId")}
     except HttpError as error:
         print(f"Gmail error: {error}")
         return None
 
-def create_draft(service, user_id, message_body, thread_id):
+def strip_quoted_text(body):
+    """Drops quoted reply history ("On ... wrote:", "> ..." lines) so thread context is not repeated."""
+    lines = []
+    for line in body.splitlines():
+        stripped = line.strip()
+        if QUOTE_HEADER_RE.match(stripped) or stripped.startswith("-----Original Message-----"):
+            break
+        if stripped.startswith(">"):
+            continue
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+def get_thread_messages(service, thread_id, new_message_ids=()):
+    """
+    Fetches a whole thread with threads.get and returns its messages oldest-first.
+    Quoted history is stripped from each body, and read history messages repeating an
+    earlier body are dropped. New (unread or listed) messages and drafts are always kept.
+    """
     try:
-        message = EmailMessage()
-        message.set_content(message_body["body"])
-        message["To"] = message_body["to"]
-        message["Subject"] = message_body["subject"]
+        thread = service.users().threads().get(userId="me", id=thread_id).execute()
+    except HttpError as error:
+        print(f"Gmail error: {error}")
+        return []
+
+    messages = []
+    seen_bodies = set()
+    for message in thread.get("messages", []):
+        content = parse_message(message)
+        content["body"] = strip_quoted_text(content["body"])
+        is_history = ("DRAFT" not in content["labelIds"] and "UNREAD" not in content["labelIds"]
+                      and content["id"] not in new_message_ids)
+        if is_history and content["body"]:
+            if content["body"] in seen_bodies:
+                continue
+            seen_bodies.add(content["body"])
+        messages.append(content)
+    return messages
 
-        encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        create_message = {"message": {"threadId": thread_id, "raw": encoded_message}}
+def create_draft(service, user_id, message_body, thread_id):
+    """Creates a new draft; use draft_manager.DraftManager to update a thread's agent draft in place."""
+    try:
+        create_message = {"message": {"threadId": thread_id, "raw": draft_manager.build_raw_message(message_body)}}
         
         draft = service.users().drafts().create(userId=user_id, body=create_message).execute()
         return draft
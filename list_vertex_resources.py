@@ -1,5 +1,9 @@
 import os
+import sys
 import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from google.cloud import aiplatform
 from google.cloud import aiplatform_v1
 from dotenv import load_dotenv
@@ -25,73 +29,98 @@ def get_available_regions(project):
         regions.sort()
         return regions
     except Exception as e:
-        print(f"Error fetching regions programmatically: {e}")
+        # stderr keeps --json output on stdout machine-readable
+        print(f"Error fetching regions programmatically: {e}", file=sys.stderr)
         # Fallback to us-central1 if discovery fails
         return ["us-central1"]
 
-def list_vertex_resources_in_region(project, location):
-    """Lists resources in a specific region."""
-    try:
-        aiplatform.init(project=project, location=location)
-        
-        # List Models
-        models = aiplatform.Model.list()
-        if models:
-            print(f"  [Models]")
-            for model in models:
-                print(f"    - Name: {model.display_name}")
-                print(f"      ID: {model.resource_name}")
-        else:
-            print("  No models found.")
-
-        # List Endpoints
-        endpoints = aiplatform.Endpoint.list()
-        if endpoints:
-            print(f"  [Endpoints]")
-            for endpoint in endpoints:
-                print(f"    - Name: {endpoint.display_name}")
-                print(f"      ID: {endpoint.resource_name}")
-        else:
-            print("  No endpoints found.")
-    except Exception as e:
-        # Some regions might not have the API enabled or have other restrictions
-        if "503" not in str(e): # Avoid spamming reauth errors if they occur
-             print(f"  Error or not enabled in this region: {e}")
-        else:
-             print("  Service unavailable or reauth required in this region.")
+# Resource types scanned per region; models are deleted after endpoints so undeploys finish first
+RESOURCE_TYPES = {
+    "endpoints": lambda: aiplatform.Endpoint,
+    "models": lambda: aiplatform.Model,
+}
+MAX_WORKERS = 16
 
-def delete_vertex_resources_in_region(project, location):
-    """Deletes resources in a specific region."""
-    try:
-        aiplatform.init(project=project, location=location)
-        
-        # Delete Endpoints (force=True undeploys models)
-        endpoints = aiplatform.Endpoint.list()
-        if endpoints:
-            print(f"  Deleting {len(endpoints)} endpoints...")
-            for endpoint in endpoints:
-                print(f"    - Deleting endpoint: {endpoint.display_name} ({endpoint.resource_name})")
-                try:
-                    endpoint.delete(force=True)
-                except Exception as del_e:
-                    print(f"      Failed to delete endpoint: {del_e}")
-        else:
-            print("  No endpoints to delete.")
-
-        # Delete Models
-        models = aiplatform.Model.list()
-        if models:
-            print(f"  Deleting {len(models)} models...")
-            for model in models:
-                print(f"    - Deleting model: {model.display_name} ({model.resource_name})")
-                try:
-                    model.delete()
-                except Exception as del_e:
-                    print(f"      Failed to delete model: {del_e}")
+def list_resources(project, location, resource_type):
+    """Lists one resource type in one region without touching aiplatform's global init state."""
+    resource_class = RESOURCE_TYPES[resource_type]()
+    return resource_class.list(project=project, location=location)
+
+def describe_error(e):
+    # Some regions might not have the API enabled or have other restrictions
+    if "503" in str(e):
+        return "Service unavailable or reauth required in this region."
+    return f"Error or not enabled in this region: {e}"
+
+def scan_regions(project, regions, resource_types=tuple(RESOURCE_TYPES), max_workers=MAX_WORKERS):
+    """
+    Lists every (region, resource type) pair concurrently.
+    Returns {region: {"endpoints": [...], "models": [...], "errors": [...]}} with resource objects.
+    """
+    results = {region: {"errors": [], **{t: [] for t in resource_types}} for region in regions}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(list_resources, project, region, resource_type): (region, resource_type)
+            for region in regions
+            for resource_type in resource_types
+        }
+        for future in as_completed(futures):
+            region, resource_type = futures[future]
+            try:
+                results[region][resource_type] = list(future.result())
+            except Exception as e:
+                results[region]["errors"].append(f"{resource_type}: {describe_error(e)}")
+    return results
+
+def delete_resources(resources, kind, max_workers=MAX_WORKERS, quiet=False):
+    """
+    Deletes resources concurrently, printing progress as each finishes.
+    Returns a list of {"name", "id", "deleted", "error"} outcomes.
+    """
+    outcomes = []
+    if not resources:
+        return outcomes
+
+    def delete(resource):
+        if kind == "endpoints":
+            resource.delete(force=True)  # force=True undeploys models
         else:
-            print("  No models to delete.")
-    except Exception as e:
-        print(f"  Error during deletion in this region: {e}")
+            resource.delete()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(delete, resource): resource for resource in resources}
+        for done, future in enumerate(as_completed(futures), 1):
+            resource = futures[future]
+            outcome = {"name": resource.display_name, "id": resource.resource_name, "deleted": True, "error": None}
+            try:
+                future.result()
+            except Exception as e:
+                outcome.update(deleted=False, error=str(e))
+            outcomes.append(outcome)
+            if not quiet:
+                status = "deleted" if outcome["deleted"] else f"FAILED ({outcome['error']})"
+                print(f"  [{done}/{len(resources)}] {kind[:-1]} {resource.display_name} ({resource.resource_name}): {status}")
+    return outcomes
+
+def describe(resource):
+    return {"name": resource.display_name, "id": resource.resource_name}
+
+def print_scan(results):
+    for location, found in results.items():
+        print(f"--- Region: {location} ---")
+        for error in found["errors"]:
+            print(f"  {error}")
+        for resource_type in RESOURCE_TYPES:
+            if resource_type not in found:
+                continue
+            if found[resource_type]:
+                print(f"  [{resource_type.capitalize()}]")
+                for resource in found[resource_type]:
+                    print(f"    - Name: {resource.display_name}")
+                    print(f"      ID: {resource.resource_name}")
+            else:
+                print(f"  No {resource_type} found.")
+        print("-" * 30 + "\n")
 
 def main():
     # Load environment variables (as per spec)
@@ -99,30 +128,61 @@ def main():
     
     parser = argparse.ArgumentParser(description="List or Delete Vertex AI resources.")
     parser.add_argument("--delete", action="store_true", help="Delete all models and endpoints found.")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable JSON instead of text.")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Concurrent API calls.")
     args = parser.parse_args()
+    log = (lambda message: None) if args.json else print
 
     project = os.environ.get("GOOGLE_CLOUD_PROJECT")
 
     if not project:
-        print("Error: GOOGLE_CLOUD_PROJECT environment variable is not set.")
+        if args.json:
+            print(json.dumps({"error": "GOOGLE_CLOUD_PROJECT environment variable is not set."}))
+        else:
+            print("Error: GOOGLE_CLOUD_PROJECT environment variable is not set.")
         return
 
-    print(f"Programmatically discovering Vertex AI regions for project: {project}...")
+    log(f"Programmatically discovering Vertex AI regions for project: {project}...")
     regions = get_available_regions(project)
     
     if not regions:
-        print("No regions found.")
+        log("No regions found.")
         return
 
-    print(f"Found {len(regions)} regions. {'DELETING' if args.delete else 'Scanning'} resources...\n")
+    log(f"Found {len(regions)} regions. {'DELETING' if args.delete else 'Scanning'} resources...\n")
 
-    for location in regions:
-        print(f"--- Region: {location} ---")
-        if args.delete:
-            delete_vertex_resources_in_region(project, location)
-        else:
-            list_vertex_resources_in_region(project, location)
-        print("-" * 30 + "\n")
+    start = time.perf_counter()
+    results = scan_regions(project, regions, max_workers=args.workers)
+    log(f"Scanned {len(regions)} regions in {time.perf_counter() - start:.1f} s.\n")
+
+    output = {
+        "project": project,
+        "regions": {
+            region: {
+                "errors": found["errors"],
+                **{t: [describe(r) for r in found[t]] for t in RESOURCE_TYPES},
+            }
+            for region, found in results.items()
+        },
+    }
+
+    if args.delete:
+        summary = {}
+        for kind in RESOURCE_TYPES:
+            resources = [r for found in results.values() for r in found[kind]]
+            log(f"Deleting {len(resources)} {kind} across all regions...")
+            outcomes = delete_resources(resources, kind, args.workers, quiet=args.json)
+            summary[kind] = {
+                "deleted": sum(1 for o in outcomes if o["deleted"]),
+                "failed": [o for o in outcomes if not o["deleted"]],
+            }
+            log(f"  {summary[kind]['deleted']} deleted, {len(summary[kind]['failed'])} failed.\n")
+        output["deleted"] = summary
+    elif not args.json:
+        print_scan(results)
+
+    if args.json:
+        print(json.dumps(output, indent=2))
 
 if __name__ == "__main__":
     main()
@@ -1,41 +1,336 @@
 import google_client
 import response_generator
+import model_router
+import draft_manager
+import os
 import time
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 
-def run_agent():
+ACTIONS_HEADER_RE = re.compile(r'Actions Needed:', re.IGNORECASE)
+ACTION_PREFIXES = ("SCHEDULE:", "SAVE:", "TASK:")
+# Side effects detected while streaming run in parallel with the rest of the draft
+ACTION_WORKERS = 4
+# Newest sent messages embedded into the correspondence index per run
+INDEX_SYNC_LIMIT = int(os.environ.get("INDEX_SYNC_LIMIT", "50"))
+# Only one run (manual, streamed or push) may read and draft at a time, or threads get drafted twice
+RUN_LOCK = threading.Lock()
+
+def run_agent(on_event=None):
     """
     Runs the agent logic and returns a list of log messages.
+    If on_event(kind, data) is given, drafts are streamed and every log line,
+    token and time-to-first-token measurement is also pushed through it.
     """
     logs = []
     def log(message):
         print(message)
         logs.append(message)
+        if on_event:
+            on_event("log", message)
 
-    load_dotenv()
-    log("Starting Agent Mailman...")
+    with RUN_LOCK:
+        load_dotenv()
+        log("Starting Agent Mailman...")
     
-    # Get Gmail service
-    gmail_service = google_client.get_service("gmail", "v1")
-    if not gmail_service:
-        log("Failed to connect to Gmail API.")
+        # Get Gmail service
+        gmail_service = google_client.get_service("gmail", "v1")
+        if not gmail_service:
+            log("Failed to connect to Gmail API.")
+            return logs
+
+        sync_sent_mail(gmail_service, log)
+        scan_unread(gmail_service, log, on_event)
         return logs
 
+def scan_unread(gmail_service, log, on_event=None):
+    """Finds all unread inbox messages and drafts responses for them."""
     log("Checking for unread messages...")
     unread_messages = google_client.get_unread_messages(gmail_service)
     
     if not unread_messages:
         log("No unread messages found.")
-        return logs
+        return
 
     log(f"Found {len(unread_messages)} unread messages.")
+    process_messages(gmail_service, unread_messages, log, on_event)
+
+def run_agent_for_history(start_history_id):
+    """
+    Processes only the messages added since start_history_id (Gmail push path).
+    Falls back to a full unread scan when there is no usable history id.
+    Returns (logs, latest_history_id); latest_history_id always comes from Gmail itself.
+    """
+    logs = []
+    def log(message):
+        print(message)
+        logs.append(message)
+
+    with RUN_LOCK:
+        load_dotenv()
+        gmail_service = google_client.get_service("gmail", "v1")
+        if not gmail_service:
+            log("Failed to connect to Gmail API.")
+            return logs, start_history_id
+
+        sync_sent_mail(gmail_service, log)
+
+        def full_scan():
+            # Read the mailbox's history id first so mail arriving during the scan is covered next time
+            history_id = google_client.get_history_id(gmail_service)
+            scan_unread(gmail_service, log)
+            return logs, history_id
+
+        if start_history_id is None:
+            log("No history id recorded yet, running a full scan.")
+            return full_scan()
 
-    for msg in unread_messages:
+        messages, latest_history_id = google_client.get_history_messages(gmail_service, start_history_id)
+        if messages is None:
+            log(f"History id {start_history_id} is no longer valid, running a full scan.")
+            return full_scan()
+
+        if not messages:
+            log(f"No new unread messages since history id {start_history_id}.")
+            return logs, latest_history_id
+
+        log(f"Found {len(messages)} new messages since history id {start_history_id}.")
+        process_messages(gmail_service, messages, log)
+        return logs, latest_history_id
+
+def sync_sent_mail(gmail_service, log, limit=INDEX_SYNC_LIMIT):
+    """
+    Incrementally adds sent mail to the correspondence index, newest first,
+    stopping at the first message that is already indexed.
+    """
+    index = response_generator.get_correspondence_index()
+    new_messages = []
+    page_token = None
+    while len(new_messages) < limit:
+        messages, page_token = google_client.list_messages(gmail_service, "in:sent", page_token)
+        known = next((i for i, msg in enumerate(messages) if msg['id'] in index), None)
+        new_messages.extend(messages[:known])
+        if known is not None or not page_token:
+            break
+    new_messages = new_messages[:limit]
+    if not new_messages:
+        return
+
+    records = []
+    for msg in new_messages:
         content = google_client.get_message_content(gmail_service, msg['id'])
+        if content:
+            records.append({
+                "id": content['id'],
+                "threadId": content['threadId'],
+                "subject": content['subject'],
+                "text": google_client.strip_quoted_text(content['body']),
+                "kind": "sent"
+            })
+    added = response_generator.index_correspondence(records)
+    log(f"Indexed {added} sent messages ({len(response_generator.get_correspondence_index())} total in correspondence index).")
+
+def group_by_thread(messages):
+    """Groups {"id", "threadId"} message stubs into {thread_id: [message_id, ...]}, keeping order."""
+    threads = {}
+    for msg in messages:
+        threads.setdefault(msg.get('threadId') or msg['id'], []).append(msg['id'])
+    return threads
+
+def build_thread_content(thread_id, thread_messages, new_message_ids):
+    """
+    Consolidates a thread into one email_content dict for triage and drafting.
+    The new (unread) messages become the body; earlier messages become context.
+    """
+    new_messages = []
+    history = []
+    agent_draft_ids = []
+    for message in thread_messages:
+        if "DRAFT" in message['labelIds']:
+            if message['isAgentDraft']:
+                agent_draft_ids.append(message['id'])
+            continue
+        if message['id'] in new_message_ids or "UNREAD" in message['labelIds']:
+            new_messages.append(message)
+        else:
+            history.append(message)
+
+    if not new_messages:
+        return None
+
+    latest = new_messages[-1]
+    if len(new_messages) == 1:
+        body = latest['body']
+    else:
+        body = "\n\n".join(f"From {m['sender']}:\n{m['body']}" for m in new_messages)
+
+    return {
+        "id": latest['id'],
+        "subject": latest['subject'],
+        "sender": latest['sender'],
+        "body": body,
+        "threadId": thread_id,
+        "thread": history,
+        "agentDraftMessageIds": agent_draft_ids
+    }
+
+def run_action(line, content, log):
+    """Executes a single SCHEDULE/SAVE/TASK action line."""
+    if "SCHEDULE:" in line.upper():
+        try:
+            # Expecting format: SCHEDULE: Title, Start, End
+            # This is a bit brittle, but works for demo purposes
+            details = line.split(":", 1)[1].strip().split(",")
+            if len(details) >= 3:
+                title, start, end = [d.strip() for d in details[:3]]
+                cal_service = google_client.get_service("calendar", "v3")
+                event = google_client.create_calendar_event(cal_service, title, start, end)
+                if event:
+                    log(f"Calendar event created: {title}")
+        except Exception as e:
+            log(f"Failed to schedule meeting: {e}")
+
+    elif "SAVE:" in line.upper():
+        try:
+            filename = line.split(":", 1)[1].strip()
+            dr_service = google_client.get_service("drive", "v3")
+            # For demo, we save the email body if no attachment logic is fully built
+            file_id = google_client.upload_file_to_drive(dr_service, filename, content['body'])
+            if file_id:
+                log(f"File saved to Drive: {filename} (ID: {file_id})")
+        except Exception as e:
+            log(f"Failed to save to Drive: {e}")
+
+    elif "TASK:" in line.upper():
+        try:
+            task_title = line.split(":", 1)[1].strip()
+            tk_service = google_client.get_service("tasks", "v1")
+            task = google_client.create_task(tk_service, task_title, f"From email: {content['subject']}")
+            if task:
+                log(f"Task created: {task_title}")
+        except Exception as e:
+            log(f"Failed to create task: {e}")
+
+def is_action_line(line):
+    return any(action in line.upper() for action in ACTION_PREFIXES)
+
+class ActionLineDetector:
+    """
+    Watches streamed draft output and returns action lines as soon as they are complete,
+    i.e. once the newline after a SCHEDULE/SAVE/TASK line under "Actions Needed:" arrives.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.position = None  # start of the first unscanned line in the actions section
+
+    def feed(self, chunk):
+        self.text += chunk
+        if self.position is None:
+            match = ACTIONS_HEADER_RE.search(self.text)
+            if not match:
+                return []
+            self.position = match.end()
+
+        lines = []
+        newline = self.text.find("\n", self.position)
+        while newline != -1:
+            lines.append(self.text[self.position:newline])
+            self.position = newline + 1
+            newline = self.text.find("\n", self.position)
+        return [line for line in lines if is_action_line(line)]
+
+    def finish(self):
+        """Returns the trailing action line if the stream ended without a newline."""
+        if self.position is None:
+            return []
+        line = self.text[self.position:]
+        self.position = len(self.text)
+        return [line] if is_action_line(line) else []
+
+def split_response(full_response):
+    """Splits model output into (draft body, actions text)."""
+    parts = ACTIONS_HEADER_RE.split(full_response, maxsplit=1)
+    draft_body_text = parts[0].replace("Draft Response:", "").strip()
+    actions_text = parts[1].strip() if len(parts) > 1 else "NONE"
+    return draft_body_text, actions_text
+
+def stream_response(content, log, on_event, action_pool, stats=None):
+    """
+    Streams the draft for one email to on_event, submitting action lines to action_pool
+    as soon as each is complete. Actions from flash output are held until it passes
+    validation, so an escalated draft's rejected actions never run. Returns (full_response, futures).
+    """
+    detector = ActionLineDetector()
+    futures = []
+    held_actions = None  # a list while actions are being held
+    start = time.perf_counter()
+    first_token_ms = None
+
+    def start_action(line):
+        log(f"Action detected while streaming: {line.strip()}")
+        futures.append(action_pool.submit(run_action, line, content, log))
+
+    on_event("draft_start", {"id": content['id'], "subject": content['subject']})
+    for chunk in response_generator.generate_response_stream(content, stats):
+        if chunk is response_generator.HOLD_ACTIONS:
+            held_actions = []
+            continue
+        if chunk is response_generator.VALIDATED:
+            for line in held_actions + detector.finish():
+                start_action(line)
+            held_actions = None
+            continue
+        if chunk is response_generator.ESCALATED:
+            log(f"Draft for '{content['subject']}' failed validation, regenerating with {response_generator.DRAFT_MODEL}")
+            if held_actions:
+                log(f"Discarded {len(held_actions)} action(s) from the rejected draft")
+            held_actions = None
+            on_event("draft_reset", {"id": content['id'], "reason": "escalated"})
+            detector = ActionLineDetector()
+            continue
+        if chunk is response_generator.FAILED:
+            # Discard partial output; the draft is only the failure notice, as in generate_response
+            text = response_generator.failure_body(content)
+            on_event("draft_reset", {"id": content['id'], "reason": "failed"})
+            on_event("token", {"id": content['id'], "text": text})
+            on_event("draft_end", {"id": content['id'], "ms": round((time.perf_counter() - start) * 1000)})
+            return text, futures
+        if first_token_ms is None:
+            first_token_ms = (time.perf_counter() - start) * 1000
+            log(f"Time to first token for '{content['subject']}': {first_token_ms:.0f} ms")
+            on_event("ttft", {"id": content['id'], "ms": round(first_token_ms)})
+        on_event("token", {"id": content['id'], "text": chunk})
+        for line in detector.feed(chunk):
+            if held_actions is not None:
+                held_actions.append(line)
+            else:
+                start_action(line)
+    for line in detector.finish():
+        start_action(line)
+    total_ms = (time.perf_counter() - start) * 1000
+    on_event("draft_end", {"id": content['id'], "ms": round(total_ms)})
+    return detector.text.strip(), futures
+
+def process_messages(gmail_service, messages, log, on_event=None):
+    """
+    Groups messages by thread, then triages, drafts a reply and runs actions once per thread.
+    With on_event set, drafts are streamed and actions start while the draft is still generating.
+    """
+    drafts = draft_manager.DraftManager(gmail_service)
+    router_stats = model_router.RouterStats()
+    action_pool = ThreadPoolExecutor(max_workers=ACTION_WORKERS) if on_event else None
+    for thread_id, message_ids in group_by_thread(messages).items():
+        thread_messages = google_client.get_thread_messages(gmail_service, thread_id, message_ids)
+        content = build_thread_content(thread_id, thread_messages, message_ids)
         if not content:
-            log(f"Could not retrieve content for message {msg['id']}")
+            log(f"Could not retrieve content for thread {thread_id}")
             continue
+        msg_id = content['id']
+        if len(message_ids) > 1:
+            log(f"Grouped {len(message_ids)} new messages in thread {thread_id}")
 
         log(f"Processing email from: {content['sender']} | Subject: {content['subject']}")
 
@@ -45,67 +340,52 @@ def run_agent():
             continue
 
         log(f"Generating draft and identifying actions for '{content['subject']}'...")
+        content['related'] = response_generator.find_related_correspondence(content)
+        if content['related']:
+            log(f"Retrieved {len(content['related'])} related past exchanges for '{content['subject']}'")
 
         # 2. Generate response and actions
-        full_response = response_generator.generate_response(content)
+        action_futures = []
+        if on_event:
+            full_response, action_futures = stream_response(content, log, on_event, action_pool, router_stats)
+        else:
+            full_response = response_generator.generate_response(content, router_stats)
         
         # Split draft and actions (simple parsing)
-        parts = re.split(r'Actions Needed:', full_response, flags=re.IGNORECASE)
-        draft_body_text = parts[0].replace("Draft Response:", "").strip()
-        actions_text = parts[1].strip() if len(parts) > 1 else "NONE"
+        draft_body_text, actions_text = split_response(full_response)
 
-        # Create draft
+        # Create the draft, or update the thread's earlier agent draft in place
         draft_message = {
             "to": content['sender'],
             "subject": f"Re: {content['subject']}",
             "body": draft_body_text
         }
-        draft = google_client.create_draft(gmail_service, "me", draft_message, content['threadId'])
+        draft, draft_action = drafts.save(draft_message, thread_id, content['agentDraftMessageIds'])
         if draft:
-            log(f"Draft created successfully for message {msg['id']}")
+            log(f"Draft {draft_action} successfully for message {msg_id}")
+            # One record per thread: each re-draft replaces the previous version
+            response_generator.index_correspondence([{
+                "id": f"draft:{thread_id}",
+                "threadId": thread_id,
+                "subject": draft_message['subject'],
+                "text": draft_body_text,
+                "kind": "draft"
+            }], replace=True)
         
-        # 3. Process Actions
-        if "NONE" not in actions_text.upper():
+        # 3. Process Actions (already running in streaming mode)
+        if action_futures:
+            wait(action_futures)
+        elif not on_event and "NONE" not in actions_text.upper():
             log(f"Processing additional actions: {actions_text}")
             
             # Simple line-based action parsing
             for line in actions_text.split('\n'):
-                if "SCHEDULE:" in line.upper():
-                    try:
-                        # Expecting format: SCHEDULE: Title, Start, End
-                        # This is a bit brittle, but works for demo purposes
-                        details = line.split(":", 1)[1].strip().split(",")
-                        if len(details) >= 3:
-                            title, start, end = [d.strip() for d in details[:3]]
-                            cal_service = google_client.get_service("calendar", "v3")
-                            event = google_client.create_calendar_event(cal_service, title, start, end)
-                            if event:
-                                log(f"Calendar event created: {title}")
-                    except Exception as e:
-                        log(f"Failed to schedule meeting: {e}")
-
-                elif "SAVE:" in line.upper():
-                    try:
-                        filename = line.split(":", 1)[1].strip()
-                        dr_service = google_client.get_service("drive", "v3")
-                        # For demo, we save the email body if no attachment logic is fully built
-                        file_id = google_client.upload_file_to_drive(dr_service, filename, content['body'])
-                        if file_id:
-                            log(f"File saved to Drive: {filename} (ID: {file_id})")
-                    except Exception as e:
-                        log(f"Failed to save to Drive: {e}")
-
-                elif "TASK:" in line.upper():
-                    try:
-                        task_title = line.split(":", 1)[1].strip()
-                        tk_service = google_client.get_service("tasks", "v1")
-                        task = google_client.create_task(tk_service, task_title, f"From email: {content['subject']}")
-                        if task:
-                            log(f"Task created: {task_title}")
-                    except Exception as e:
-                        log(f"Failed to create task: {e}")
-    
-    return logs
+                run_action(line, content, log)
+
+    if action_pool:
+        action_pool.shutdown(wait=True)
+    if router_stats.emails:
+        log(router_stats.summary())
 
 def main():
     run_agent()
@@ -0,0 +1,125 @@
+import os
+import re
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# --- Routing configuration ---
+# Tiers map to models in response_generator; this module never calls the API so it can run offline.
+FLASH_TIER = "flash"
+PRO_TIER = "pro"
+COMPLEXITY_THRESHOLD = float(os.environ.get("ROUTER_COMPLEXITY_THRESHOLD", "3.0"))
+# Comma-separated addresses or domains (e.g. "boss@example.com,@bigclient.com") that always merit care
+IMPORTANT_SENDERS = [s.strip().lower() for s in os.environ.get("IMPORTANT_SENDERS", "").split(",") if s.strip()]
+ACTION_KEYWORDS = (
+    "meeting", "schedule", "calendar", "call", "availability", "attach",
+    "deadline", "task", "contract", "proposal", "invoice", "agenda",
+)
+
+ACTIONS_HEADER_RE = re.compile(r'Actions Needed:', re.IGNORECASE)
+ACTION_LINE_RE = re.compile(r'(SCHEDULE|SAVE|TASK):(.*)', re.IGNORECASE)
+
+def extract_features(email_content):
+    """Computes the cheap, local features used to score an email's complexity."""
+    body = email_content.get("body", "")
+    sender = email_content.get("sender", "").lower()
+    lowered = body.lower()
+    return {
+        "words": len(body.split()),
+        "thread_depth": len(email_content.get("thread", [])),
+        "questions": body.count("?"),
+        "action_hints": sum(1 for keyword in ACTION_KEYWORDS if keyword in lowered),
+        "important_sender": any(important in sender for important in IMPORTANT_SENDERS),
+    }
+
+def score_features(features):
+    """Turns features into a complexity score; each feature's contribution is capped."""
+    score = min(features["words"] / 150, 3.0)
+    score += 0.5 * min(features["thread_depth"], 4)
+    score += 0.5 * min(features["questions"], 3)
+    score += 1.0 * min(features["action_hints"], 3)
+    if features["important_sender"]:
+        score += 2.0
+    return round(score, 2)
+
+def route(email_content):
+    """Picks the drafting tier for an email. Returns {"tier", "score", "features"}."""
+    features = extract_features(email_content)
+    score = score_features(features)
+    tier = PRO_TIER if score >= COMPLEXITY_THRESHOLD else FLASH_TIER
+    return {"tier": tier, "score": score, "features": features}
+
+def validate_response(text):
+    """
+    Checks that a draft follows the expected structure: a non-empty draft followed by an
+    "Actions Needed:" section whose action lines carry usable details.
+    """
+    parts = ACTIONS_HEADER_RE.split(text, maxsplit=1)
+    if len(parts) < 2:
+        return False
+    if not parts[0].replace("Draft Response:", "").strip():
+        return False
+    for line in parts[1].splitlines():
+        match = ACTION_LINE_RE.search(line)
+        if not match:
+            continue
+        action, details = match.group(1).upper(), match.group(2).strip()
+        if not details:
+            return False
+        if action == "SCHEDULE" and len([d for d in details.split(",") if d.strip()]) < 3:
+            return False
+    return True
+
+class RouterStats:
+    """
+    Collects one routing outcome per email for a run, so per-tier latency and the net time
+    saved by flash routing can be reported. Escalated emails count against the savings:
+    they paid for a flash attempt on top of the pro draft.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.emails = []
+
+    def record(self, tier, latency_ms, escalated_latency_ms=None):
+        """Records one email: the routed tier's latency and, if escalated, the pro retry's latency."""
+        with self._lock:
+            self.emails.append({"tier": tier, "latency_ms": latency_ms, "escalated_latency_ms": escalated_latency_ms})
+
+    def summary(self):
+        flash = [e for e in self.emails if e["tier"] == FLASH_TIER and e["escalated_latency_ms"] is None]
+        escalated = [e for e in self.emails if e["escalated_latency_ms"] is not None]
+        pro = [e for e in self.emails if e["tier"] == PRO_TIER]
+
+        pro_latencies = [e["latency_ms"] for e in pro] + [e["escalated_latency_ms"] for e in escalated]
+        flash_latencies = [e["latency_ms"] for e in flash + escalated]
+        pro_avg = sum(pro_latencies) / len(pro_latencies) if pro_latencies else None
+        flash_avg = sum(flash_latencies) / len(flash_latencies) if flash_latencies else None
+
+        text = (
+            f"Model routing: {len(self.emails)} emails, {len(flash)} flash, {len(pro)} pro,"
+            f" {len(escalated)} escalated flash->pro"
+            f" (avg flash {flash_avg or 0:.0f} ms, avg pro {pro_avg or 0:.0f} ms)"
+        )
+        if pro_avg is not None and flash_latencies:
+            # Versus drafting everything on pro: flash emails save (pro_avg - flash), escalated ones lose their flash attempt
+            saved_ms = sum(pro_avg - e["latency_ms"] for e in flash) - sum(e["latency_ms"] for e in escalated)
+            text += f", net {saved_ms / 1000:+.1f} s from flash routing"
+        return text
+
+if __name__ == "__main__":
+    # Offline check of routing decisions on representative emails
+    samples = [
+        {"sender": "friend@example.com", "body": "Thanks, see you tomorrow!"},
+        {"sender": "colleague@example.com", "body": "Can we schedule a meeting next week to review the proposal? "
+                                                     "Please attach the latest contract. What times work?"},
+        {"sender": "colleague@example.com", "body": "Quick question about lunch?", "thread": [{}] * 6},
+        {"sender": "client@bigclient.com", "body": " ".join(["word"] * 500) + " deadline?"},
+    ]
+    for sample in samples:
+        decision = route(sample)
+        print(f"{decision['tier']:5} score={decision['score']:<5} {decision['features']}")
+    print(validate_response("Sounds good.<br>\nActions Needed:\nSCHEDULE: Sync, 2026-01-05T10:00:00Z, 2026-01-05T10:30:00Z"))
+    print(validate_response("Sounds good.\nActions Needed:\nSCHEDULE: Sync"))
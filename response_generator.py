@@ -1,6 +1,10 @@
 from google import genai
+from google.genai import types
 import secret_manager_utils
+import model_router
+import correspondence_index
 import os
+import time
 from dotenv import load_dotenv
 
 # Load environment variables (Spec compliance: DO use python-dotenv for variable references)
@@ -9,6 +13,8 @@ load_dotenv()
 # --- Prompt Variables (Spec compliance: Top of file) ---
 MAX_LENGTH_DIRECTIVE = "MAXIMUM TWO TO THREE SENTENCES"
 HTML_OUTPUT_DIRECTIVE = "Format output with HTML tags (e.g., <br> for new lines) for better rendering in web UIs."
+THREAD_CONTEXT_MAX_MESSAGES = 10
+THREAD_CONTEXT_MAX_CHARS = 1500
 
 def load_persona():
     """Reads the persona from persona.md."""
@@ -25,6 +31,21 @@ PERSONA = load_persona()
 # Jan 2026 search confirms Gemini 3 is production-ready, but IDs use -preview suffix.
 TRIAGE_MODEL = "gemini-3-flash-preview"
 DRAFT_MODEL = "gemini-3-pro-preview"
+# Drafts are routed per email by model_router: simple replies go to flash, complex ones to pro.
+TIER_MODELS = {
+    model_router.FLASH_TIER: TRIAGE_MODEL,
+    model_router.PRO_TIER: DRAFT_MODEL,
+}
+EMBEDDING_MODEL = "gemini-embedding-001"
+EMBEDDING_DIM = 768
+RELATED_TOP_K = 5
+# Yielded by generate_response_stream around flash output: actions must be held until it validates.
+HOLD_ACTIONS = object()
+VALIDATED = object()
+# Yielded by generate_response_stream when flash output fails validation and pro output follows.
+ESCALATED = object()
+# Yielded by generate_response_stream when generation fails; the draft becomes failure_body().
+FAILED = object()
 
 # Initialize Client
 secret_id = os.environ.get("SECRET_GEMINI", "GEMINI_API_KEY")
@@ -36,6 +57,86 @@ if api_key:
 else:
     print(f"Warning: {secret_id} not found in Secret Manager.")
 
+def format_thread_context(email_content):
+    """Renders earlier messages of the conversation (oldest first) for the draft prompt."""
+    history = email_content.get("thread", [])[-THREAD_CONTEXT_MAX_MESSAGES:]
+    if not history:
+        return ""
+    entries = [f"From: {m['sender']}\n{m['body'][:THREAD_CONTEXT_MAX_CHARS]}" for m in history]
+    return "Earlier messages in this conversation (for context only):\n\n" + "\n\n---\n\n".join(entries)
+
+correspondence = None
+
+def get_correspondence_index():
+    """Opens the on-disk index of past correspondence on first use."""
+    global correspondence
+    if correspondence is None:
+        correspondence = correspondence_index.CorrespondenceIndex(dim=EMBEDDING_DIM)
+    return correspondence
+
+def embed_texts(texts, task_type="RETRIEVAL_DOCUMENT"):
+    """Embeds texts with the Gemini embedding model. Returns a list of vectors or None on error."""
+    if not client:
+        return None
+    try:
+        result = client.models.embed_content(
+            model=EMBEDDING_MODEL,
+            contents=texts,
+            config=types.EmbedContentConfig(task_type=task_type, output_dimensionality=EMBEDDING_DIM)
+        )
+        return [embedding.values for embedding in result.embeddings]
+    except Exception as e:
+        print(f"Error embedding text with Gemini: {e}")
+        return None
+
+def index_correspondence(records, replace=False):
+    """
+    Embeds and adds past exchanges ({"id", "threadId", "subject", "text", "kind"}) to the index.
+    With replace=True, records whose id is already indexed are re-embedded and overwritten
+    when their text or subject changed.
+    Returns the number of records added or replaced.
+    """
+    index = get_correspondence_index()
+
+    def needs_indexing(record):
+        existing = index.get(record["id"])
+        if existing is None:
+            return True
+        # Skip unchanged records (e.g. a thread re-drafted with the same text) instead of re-embedding them
+        return replace and (existing["text"], existing.get("subject")) != (record["text"][:correspondence_index.MAX_RECORD_CHARS], record.get("subject"))
+
+    records = [r for r in records if r["text"].strip() and needs_indexing(r)]
+    added = 0
+    # The embedding API accepts at most 100 texts per request
+    for start in range(0, len(records), 100):
+        batch = records[start:start + 100]
+        vectors = embed_texts([f"Subject: {r['subject']}\n{r['text']}" for r in batch])
+        if vectors is None:
+            break
+        added += index.add(batch, vectors, replace)
+    return added
+
+def find_related_correspondence(email_content):
+    """Retrieves the most relevant past exchanges that fit the prompt's token budget."""
+    index = get_correspondence_index()
+    if not len(index):
+        return []
+    query = f"Subject: {email_content.get('subject', '')}\n{email_content.get('body', '')}"
+    vectors = embed_texts([query], task_type="RETRIEVAL_QUERY")
+    if not vectors:
+        return []
+    results = index.search(vectors[0], RELATED_TOP_K, exclude_thread_id=email_content.get("threadId"))
+    return correspondence_index.select_within_budget(results)
+
+def format_related_context(email_content):
+    """Renders retrieved past exchanges for the draft prompt."""
+    related = email_content.get("related", [])
+    if not related:
+        return ""
+    entries = [f"Subject: {r['subject']}\n{r['text']}" for r in related]
+    return ("Relevant past correspondence written by Matt (match its tone and keep facts consistent):\n\n"
+            + "\n\n---\n\n".join(entries))
+
 def should_respond(email_content):
     """
     Analyzes email to determine if a response is needed using a lightweight model.
@@ -84,21 +185,19 @@ def should_respond(email_content):
         # Let's default to False to avoid errors causing draft explosions.
         return False
 
-def generate_response(email_content):
-    """
-    Generates a draft response and identifies necessary actions (Calendar, Drive, Tasks).
-    """
-    if not client:
-        return f"Error: GEMINI_API_KEY is missing.\n\nOriginal Message:\n{email_content.get('body', '')}"
-
+def build_draft_prompt(email_content):
+    """Builds the drafting prompt shared by the blocking and streaming paths."""
     subject = email_content.get("subject", "No Subject")
     sender = email_content.get("sender", "Unknown Sender")
     body = email_content.get("body", "")
+    thread_context = format_thread_context(email_content)
+    related_context = format_related_context(email_content)
 
-    prompt = f"""
+    return f"""
     {PERSONA}
     
-    Review the following email and draft a response for Matt Ashton.
+    Review the following email and draft a single response for Matt Ashton.
+    If several new messages are included, address them together in one reply.
     
     {MAX_LENGTH_DIRECTIVE}
     {HTML_OUTPUT_DIRECTIVE}
@@ -108,6 +207,10 @@ def generate_response(email_content):
     2. SAVE: Should any mentioned attachments be saved? (Provide filename)
     3. TASK: Does this mention a task for the user? (Provide task title)
 
+    {related_context}
+
+    {thread_context}
+
     Sender: {sender}
     Subject: {subject}
     
@@ -117,15 +220,103 @@ def generate_response(email_content):
     Draft Response:
     
     Actions Needed:
-    [List any actions in the format ACTION: DETAILS or NONE]
+    [List any actions in the format ACTION: DETAILS or NONE, one per line]
+    """
+
+def log_route(email_content, decision):
+    print(f"Routing '{email_content.get('subject', 'No Subject')}' to {decision['tier']} "
+          f"(score {decision['score']}, features {decision['features']})")
+
+def failure_body(email_content):
+    return f"[Draft generation failed. Original message below]\n\n{email_content.get('body', '')}"
+
+def generate_response(email_content, stats=None):
     """
+    Generates a draft response and identifies necessary actions (Calendar, Drive, Tasks).
+    The model tier is chosen by model_router; flash output that fails validation is redone on pro.
+    The outcome is recorded in stats (a model_router.RouterStats) if given.
+    """
+    if not client:
+        return f"Error: GEMINI_API_KEY is missing.\n\nOriginal Message:\n{email_content.get('body', '')}"
+
+    prompt = build_draft_prompt(email_content)
+    decision = model_router.route(email_content)
+    log_route(email_content, decision)
+    tier = decision["tier"]
 
     try:
+        start = time.perf_counter()
         response = client.models.generate_content(
-            model=DRAFT_MODEL,
+            model=TIER_MODELS[tier],
             contents=prompt
         )
-        return response.text.strip()
+        text = response.text.strip()
+        latency_ms = (time.perf_counter() - start) * 1000
+        escalated_latency_ms = None
+
+        if tier == model_router.FLASH_TIER and not model_router.validate_response(text):
+            print(f"Flash draft failed validation, escalating to {DRAFT_MODEL}.")
+            start = time.perf_counter()
+            response = client.models.generate_content(
+                model=DRAFT_MODEL,
+                contents=prompt
+            )
+            text = response.text.strip()
+            escalated_latency_ms = (time.perf_counter() - start) * 1000
+        if stats:
+            stats.record(tier, latency_ms, escalated_latency_ms)
+        return text
     except Exception as e:
         print(f"Error generating response with Gemini: {e}")
-        return f"[Draft generation failed. Original message below]\n\n{body}"
+        return failure_body(email_content)
+
+def stream_model(model, prompt):
+    for chunk in client.models.generate_content_stream(
+        model=model,
+        contents=prompt
+    ):
+        if chunk.text:
+            yield chunk.text
+
+def generate_response_stream(email_content, stats=None):
+    """
+    Same as generate_response, but yields the output in chunks as the model produces them.
+    Flash output is preceded by HOLD_ACTIONS and followed by VALIDATED once it passes validation;
+    if it fails, ESCALATED is yielded and the pro output follows.
+    If generation fails, FAILED is yielded and the stream ends; chunks already sent are void.
+    """
+    if not client:
+        yield f"Error: GEMINI_API_KEY is missing.\n\nOriginal Message:\n{email_content.get('body', '')}"
+        return
+
+    prompt = build_draft_prompt(email_content)
+    decision = model_router.route(email_content)
+    log_route(email_content, decision)
+    tier = decision["tier"]
+
+    try:
+        if tier == model_router.FLASH_TIER:
+            yield HOLD_ACTIONS
+        start = time.perf_counter()
+        chunks = []
+        for text in stream_model(TIER_MODELS[tier], prompt):
+            chunks.append(text)
+            yield text
+        latency_ms = (time.perf_counter() - start) * 1000
+        escalated_latency_ms = None
+
+        if tier == model_router.FLASH_TIER:
+            if model_router.validate_response("".join(chunks)):
+                yield VALIDATED
+            else:
+                print(f"Flash draft failed validation, escalating to {DRAFT_MODEL}.")
+                yield ESCALATED
+                start = time.perf_counter()
+                for text in stream_model(DRAFT_MODEL, prompt):
+                    yield text
+                escalated_latency_ms = (time.perf_counter() - start) * 1000
+        if stats:
+            stats.record(tier, latency_ms, escalated_latency_ms)
+    except Exception as e:
+        print(f"Error streaming response with Gemini: {e}")
+        yield FAILED
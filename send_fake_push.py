@@ -0,0 +1,67 @@
+import argparse
+import base64
+import json
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+def build_envelope(email_address, history_id, message_id):
+    """Builds a Pub/Sub push envelope in the shape Gmail users.watch delivers."""
+    notification = {"emailAddress": email_address, "historyId": history_id}
+    return {
+        "message": {
+            "data": base64.b64encode(json.dumps(notification).encode("utf-8")).decode("utf-8"),
+            "messageId": str(message_id),
+            "publishTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "subscription": "projects/local/subscriptions/agent-mailman-push",
+    }
+
+def send_push(url, envelope):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(envelope).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def main():
+    parser = argparse.ArgumentParser(description="Send fake Gmail push notifications to a local Agent Mailman.")
+    parser.add_argument("--url", default="http://localhost:5000/gmail/push", help="Push endpoint URL.")
+    parser.add_argument("--token", help="Shared verification token (the SECRET_PUSH_TOKEN value).")
+    parser.add_argument("--email", default="me@example.com", help="emailAddress field of the notification.")
+    parser.add_argument("--history-id", type=int, required=True, help="History id of the first notification.")
+    parser.add_argument("--burst", type=int, default=1, help="Number of notifications to send, with increasing history ids.")
+    parser.add_argument("--interval", type=float, default=0.05, help="Seconds between notifications in a burst.")
+    args = parser.parse_args()
+    url = args.url
+    if args.token:
+        url += ("&" if "?" in url else "?") + urllib.parse.urlencode({"token": args.token})
+
+    def send(i):
+        envelope = build_envelope(args.email, args.history_id + i, i + 1)
+        start = time.perf_counter()
+        status = send_push(url, envelope)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        print(f"Sent historyId {args.history_id + i}: HTTP {status} in {elapsed_ms:.1f} ms")
+
+    # Pushes are acked only once processed, so a burst is sent concurrently like Pub/Sub would
+    senders = []
+    for i in range(args.burst):
+        sender = threading.Thread(target=send, args=(i,))
+        sender.start()
+        senders.append(sender)
+        if i < args.burst - 1:
+            time.sleep(args.interval)
+    for sender in senders:
+        sender.join()
+
+if __name__ == "__main__":
+    main()